@@ -1,12 +1,14 @@
 import pandas as pd
 import numpy as np
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Union
 import logging
 import scipy.optimize as optim
+from scipy import sparse
 from copy import deepcopy
 
 from karpiu.models import MMM
 from karpiu.model_shell import MMMShellLegacy
+from .optim_utils import derive_jac, total_budget_matrix, minimize_slsqp
 
 
 class BudgetOptimizer(MMMShellLegacy):
@@ -22,7 +24,15 @@ class BudgetOptimizer(MMMShellLegacy):
         spend_scaler: float = 1.0,
         logger: Optional[logging.Logger] = None,
         total_budget_override: Optional[float] = None,
+        collapse_mode: str = "none",
+        weight: Optional[np.ndarray] = None,
     ):
+        if collapse_mode not in ["none", "channel", "time"]:
+            raise Exception(
+                "Input collapse_mode must be one of 'none', 'channel' or 'time'."
+            )
+        self.collapse_mode = collapse_mode
+
         self.optim_channels = optim_channels
         self.optim_channels.sort()
 
@@ -52,23 +62,86 @@ class BudgetOptimizer(MMMShellLegacy):
 
         self.constraints = list()
         self.budget_mask = self.input_mask
+        # positional indices of budget period and optimizing channels; derived once and reused for
+        # slicing inputs and writing back solutions
+        self._budget_row_idx = np.flatnonzero(self.budget_mask)
+        # get_loc raises KeyError on unknown channels as label based slicing does
+        self._optim_col_idx = np.array(
+            [self.df.columns.get_loc(ch) for ch in self.optim_channels]
+        )
 
         # derive optimization input
         # derive init values
         # (n_budget_steps * n_optim_channels, )
-        self.init_spend_matrix = self.df.loc[
-            self.budget_mask, self.optim_channels
+        self.init_spend_matrix = self.df.iloc[
+            self._budget_row_idx, self._optim_col_idx
         ].values
         # (n_budget_steps * n_optim_channels, ); this stores current optimal spend
-        self.curr_spend_matrix = deepcopy(self.init_spend_matrix)
+        self.curr_spend_matrix = self.init_spend_matrix.copy()
         self.n_optim_channels = len(self.optim_channels)
-        n_budget_steps = np.sum(self.input_mask)
+        n_budget_steps = self._budget_row_idx.size
         if total_budget_override is not None and total_budget_override > 0:
             self.total_budget = total_budget_override
         else:
             self.total_budget = np.sum(self.init_spend_matrix)
         self.n_budget_steps = n_budget_steps
 
+        # collapsing one axis with a fixed allocation pattern (weight) shrinks the decision variables
+        # from (n_budget_steps * n_optim_channels, ) to (n_optim_channels, ) or (n_budget_steps, )
+        if self.collapse_mode == "channel":
+            # spend allocation on time dimension
+            # (n_budget_steps, )
+            if weight is None:
+                self.weight = np.sum(self.init_spend_matrix, -1) / np.sum(
+                    self.init_spend_matrix
+                )
+            else:
+                self.weight = weight
+            if len(self.weight) != self.n_budget_steps:
+                raise Exception("Input weight has different length from budget period.")
+            self.n_optim_vars = self.n_optim_channels
+        elif self.collapse_mode == "time":
+            # spend allocation on channel dimension
+            # (n_optim_channels, )
+            if weight is None:
+                self.weight = np.sum(self.init_spend_matrix, 0) / np.sum(
+                    self.init_spend_matrix
+                )
+            else:
+                self.weight = weight
+            if len(self.weight) != self.n_optim_channels:
+                raise Exception(
+                    "Input weight has different length from number of optimizing channels."
+                )
+            self.n_optim_vars = self.n_budget_steps
+        else:
+            self.weight = None
+            self.n_optim_vars = self.n_budget_steps * self.n_optim_channels
+
+        # linear expansion from decision variables into spend vector; constraints on spend are composed with it
+        # spend vector is flattened from (n_budget_steps, n_optim_channels) in row-major order
+        # (n_budget_steps * n_optim_channels, n_optim_vars)
+        if self.collapse_mode == "channel":
+            expand_matrix = sparse.kron(
+                self.weight.reshape(-1, 1), sparse.eye(self.n_optim_channels)
+            )
+        elif self.collapse_mode == "time":
+            expand_matrix = sparse.kron(
+                sparse.eye(self.n_budget_steps), self.weight.reshape(-1, 1)
+            )
+        else:
+            expand_matrix = sparse.eye(self.n_optim_vars)
+        self._expand_matrix = sparse.csr_matrix(expand_matrix)
+
+        # selector of channel total spend built once
+        # (n_optim_channels, n_optim_vars)
+        self._channel_total_matrix = sparse.csr_matrix(
+            sparse.kron(
+                np.ones((1, self.n_budget_steps)), sparse.eye(self.n_optim_channels)
+            )
+            @ self._expand_matrix
+        )
+
         total_budget_constraint = self.generate_total_budget_constraint(
             total_budget=self.total_budget
         )
@@ -78,14 +151,16 @@ class BudgetOptimizer(MMMShellLegacy):
 
         # derive budget bounds for each step and each channel
         self.budget_bounds = optim.Bounds(
-            lb=np.zeros(n_budget_steps * self.n_optim_channels),
-            ub=np.ones(n_budget_steps * self.n_optim_channels) * np.inf,
+            lb=np.zeros(self.n_optim_vars),
+            ub=np.full(self.n_optim_vars, np.inf),
         )
 
         # create a dict to store all return metrics from callback
         self.callback_metrics = dict()
         self._init_callback_metrics()
         self.bounds_and_constraints_df = None
+        # last solution; used as the initial values with optimize(init="last")
+        self._last_x = None
 
     def set_constraints(self, constraints: List[optim.LinearConstraint]):
         self.constraints = constraints
@@ -99,25 +174,43 @@ class BudgetOptimizer(MMMShellLegacy):
         # derive budget constraints based on total sum of init values
         # scipy.optimize.LinearConstraint notation: lb <= A.dot(x) <= ub
         total_budget_constraint = optim.LinearConstraint(
-            A=np.ones(self.n_budget_steps * self.n_optim_channels),
+            # sum of the expanded spend; equal to sum of decision variables only without collapse mode
+            A=total_budget_matrix(self.n_budget_steps * self.n_optim_channels)
+            @ self._expand_matrix,
             lb=np.zeros(1),
             # lb=np.ones(1) * total_budget / self.spend_scaler,
-            ub=np.ones(1) * total_budget / self.spend_scaler,
+            ub=np.full(1, total_budget / self.spend_scaler),
         )
         return total_budget_constraint
 
+    def generate_individual_channel_constraints(
+        self, delta: float = 0.1
+    ) -> List[optim.LinearConstraint]:
+        # allow total spend of each channel deviating by delta from its initial total spend
+        # (n_optim_channels, )
+        init_channel_total = np.sum(self.init_spend_matrix, 0) / self.spend_scaler
+        lb = (1 - delta) * init_channel_total
+        ub = (1 + delta) * init_channel_total
+        # one constraint with a row per channel such that all channel totals are evaluated in a single matvec
+        ind_budget_constraint = optim.LinearConstraint(
+            A=self._channel_total_matrix,
+            lb=lb,
+            ub=ub,
+        )
+        return [ind_budget_constraint]
+
     def get_df(self) -> pd.DataFrame:
         df = self.df.copy()
         return df
 
     def get_current_state(self) -> np.ndarray:
-        return deepcopy(self.curr_spend_matrix)
+        return self.curr_spend_matrix.copy()
 
     def get_total_budget(self) -> float:
-        return deepcopy(self.total_budget)
+        return float(self.total_budget)
 
     def get_init_state(self) -> np.ndarray:
-        return deepcopy(self.init_spend_matrix)
+        return self.init_spend_matrix.copy()
 
     def get_callback_metrics(self) -> Dict[str, np.ndarray]:
         return deepcopy(self.callback_metrics)
@@ -127,17 +220,41 @@ class BudgetOptimizer(MMMShellLegacy):
             "Abstract objective function. Child class needs to override this method to have concrete result."
         )
 
+    def objective_grad(self, spend: np.ndarray) -> np.ndarray:
+        raise Exception(
+            "Abstract objective gradient function. Child class needs to override this method to supply analytic gradient."
+        )
+
+    def batched_objective_func(self, spend_batch: np.ndarray) -> np.ndarray:
+        # (n_batches, n_budget_steps * n_optim_channels) -> (n_batches, )
+        # child class can override this with a vectorized version
+        return np.array([self.objective_func(spend) for spend in spend_batch])
+
     def optimize(
         self,
-        init: Optional[np.ndarray] = None,
+        init: Optional[Union[np.ndarray, str]] = None,
         maxiter: int = 2,
         eps: Optional[float] = None,
         ftol: float = 1e-7,
         disp: bool = True,
+        grad_method: str = "auto",
+        workers: Optional[int] = None,
     ) -> None:
-        if init is None:
-            x0 = self.init_spend_matrix.flatten() / self.spend_scaler
+        # init is either the full spend matrix with shape (n_budget_steps, n_optim_channels) or the flattened
+        # decision variables; under collapse mode, the latter is the collapsed spend array
+        if isinstance(init, str) and init == "last":
+            # warm start from the solution of the previous optimize() call
+            if self._last_x is None:
+                raise Exception(
+                    "No previous solution to warm start. Call optimize() without init='last' first."
+                )
+            x0 = self._last_x.copy()
+        elif init is None:
+            x0 = self._collapse_spend(self.init_spend_matrix) / self.spend_scaler
         else:
+            if np.ndim(init) == 2:
+                # full spend matrix e.g. from get_init_state(); collapse into decision variables
+                init = self._collapse_spend(init)
             x0 = init.flatten() / self.spend_scaler
 
         # clear all solutions
@@ -151,25 +268,87 @@ class BudgetOptimizer(MMMShellLegacy):
         if eps is not None:
             options["eps"] = eps
 
-        sol = optim.minimize(
-            self.objective_func,
+        if self.collapse_mode == "none":
+            objective_func = self.objective_func
+        else:
+            objective_func = self._collapsed_objective_func
+        if type(self).objective_grad is BudgetOptimizer.objective_grad:
+            objective_grad = None
+        elif self.collapse_mode == "none":
+            objective_grad = self.objective_grad
+        else:
+            objective_grad = self._collapsed_objective_grad
+        jac = derive_jac(
+            grad_method=grad_method,
+            objective_grad=objective_grad,
+            batched_objective_func=lambda x: self.batched_objective_func(
+                self._expand_spend(x)
+            ),
+            eps=eps,
+        )
+
+        optim_x = minimize_slsqp(
+            objective_func,
             x0=x0,
-            method="SLSQP",
             bounds=self.budget_bounds,
             constraints=self.constraints,
             options=options,
             callback=self.optim_callback,
+            logger=self.logger,
+            jac=jac,
+            workers=workers,
         )
 
+        self._last_x = optim_x
+
         optim_spend_matrix = (
-            sol.x.reshape(-1, self.n_optim_channels) * self.spend_scaler
+            self._expand_spend(optim_x).reshape(-1, self.n_optim_channels)
+            * self.spend_scaler
         )
         optim_spend_matrix = np.round(optim_spend_matrix, 5)
         optim_df = self.get_df()
-        optim_df.loc[self.budget_mask, self.optim_channels] = optim_spend_matrix
+        optim_df.iloc[self._budget_row_idx, self._optim_col_idx] = optim_spend_matrix
         self.curr_spend_matrix = optim_spend_matrix
         return optim_df
 
+    def _collapse_spend(self, spend_matrix: np.ndarray) -> np.ndarray:
+        # (n_budget_steps, n_optim_channels) -> decision variables
+        # inverse of _expand_spend for spend following the allocation pattern; weight is not required to sum to 1
+        if self.collapse_mode == "channel":
+            return np.sum(spend_matrix, 0) / np.sum(self.weight)
+        elif self.collapse_mode == "time":
+            return np.sum(spend_matrix, -1) / np.sum(self.weight)
+        else:
+            return spend_matrix.flatten()
+
+    def _expand_spend(self, x: np.ndarray) -> np.ndarray:
+        # decision variables (..., n_optim_vars) -> (..., n_budget_steps * n_optim_channels)
+        if self.collapse_mode == "channel":
+            # (n_budget_steps, 1) * (..., 1, n_optim_channels)
+            spend_matrix = self.weight[:, None] * x[..., None, :]
+        elif self.collapse_mode == "time":
+            # (..., n_budget_steps, 1) * (n_optim_channels, )
+            spend_matrix = x[..., :, None] * self.weight
+        else:
+            return x
+        return spend_matrix.reshape(x.shape[:-1] + (-1,))
+
+    def _collapsed_objective_func(self, x: np.ndarray) -> np.ndarray:
+        return self.objective_func(self._expand_spend(x))
+
+    def _collapsed_objective_grad(self, x: np.ndarray) -> np.ndarray:
+        # chain rule through the linear expansion
+        # (n_budget_steps, n_optim_channels)
+        grad_matrix = self.objective_grad(self._expand_spend(x)).reshape(
+            -1, self.n_optim_channels
+        )
+        if self.collapse_mode == "channel":
+            return np.sum(grad_matrix * np.expand_dims(self.weight, -1), 0)
+        elif self.collapse_mode == "time":
+            return np.sum(grad_matrix * self.weight, -1)
+        else:
+            return grad_matrix.flatten()
+
     def _init_callback_metrics(self):
         self.callback_metrics = {"xs": list()}
 
@@ -0,0 +1,146 @@
+import numpy as np
+import scipy
+import scipy.optimize as optim
+from scipy import sparse
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Callable, List, Dict
+
+# parallel finite difference through `workers` is supported by SLSQP since scipy 1.16
+SCIPY_VERSION = tuple(int(v) for v in scipy.__version__.split(".")[:2])
+SCIPY_SLSQP_WORKERS = SCIPY_VERSION >= (1, 16)
+
+# marks threads of the finite difference pool such that objectives can avoid nested parallelism
+_fd_worker_state = threading.local()
+
+
+def _mark_fd_worker():
+    _fd_worker_state.active = True
+
+
+def in_fd_worker() -> bool:
+    """whether the caller runs in a thread of the finite difference pool derived by derive_fd_executor"""
+    return getattr(_fd_worker_state, "active", False)
+
+
+def total_budget_matrix(n_vars: int) -> sparse.csr_matrix:
+    """(1, n_vars) row of ones used as the total budget constraint; built from coordinates without a dense
+    intermediate
+    """
+    return sparse.csr_matrix(
+        (np.ones(n_vars), (np.zeros(n_vars, dtype=int), np.arange(n_vars))),
+        shape=(1, n_vars),
+    )
+
+
+def batched_fd_grad(
+    batched_objective_func: Callable, x: np.ndarray, eps: float
+) -> np.ndarray:
+    """forward difference with all perturbed points evaluated in a single batch
+    batched_objective_func: maps (n_batches, n_vars) to (n_batches, )
+    x: 1-D array like with shape (n_vars, )
+    returns: 1-D array like with shape (n_vars, )
+    """
+    n_vars = x.shape[0]
+    # (n_vars + 1, n_vars); first row is the unperturbed point
+    spend_batch = np.tile(x, (n_vars + 1, 1))
+    spend_batch[1:] += eps * np.eye(n_vars)
+    losses = batched_objective_func(spend_batch)
+    return (losses[1:] - losses[0]) / eps
+
+
+def derive_jac(
+    grad_method: str,
+    objective_grad: Optional[Callable],
+    batched_objective_func: Callable,
+    eps: Optional[float] = None,
+) -> Optional[Callable]:
+    """derive the jac argument passed into scipy.optimize.minimize
+    Args:
+        grad_method (str): one of "auto", "analytic", "batched_finite_diff" and "finite_diff"; "auto" uses
+        analytic gradient when objective_grad is supplied and otherwise falls back to scipy finite difference
+        objective_grad (callable): analytic gradient of the objective; None when it is not available
+        batched_objective_func (callable): vectorized objective used in "batched_finite_diff"
+        eps (float): step size used in "batched_finite_diff"
+    """
+    if grad_method == "auto":
+        grad_method = "analytic" if objective_grad is not None else "finite_diff"
+
+    if grad_method == "analytic":
+        if objective_grad is None:
+            raise Exception(
+                "Analytic gradient is not available. Child class needs to override objective_grad."
+            )
+        return objective_grad
+    elif grad_method == "batched_finite_diff":
+        if eps is None:
+            # same default step size used by scipy SLSQP
+            eps = np.sqrt(np.finfo(float).eps)
+        return lambda x: batched_fd_grad(batched_objective_func, x, eps)
+    elif grad_method == "finite_diff":
+        return None
+    else:
+        raise Exception(
+            "Input grad_method must be one of 'auto', 'analytic', 'batched_finite_diff' or 'finite_diff'."
+        )
+
+
+def derive_fd_executor(
+    workers: Optional[int],
+    jac: Optional[Callable],
+    logger: logging.Logger,
+) -> Optional[ThreadPoolExecutor]:
+    """derive the thread pool used by scipy to evaluate finite difference in parallel; only relevant when
+    scipy derives the gradient itself
+    """
+    if workers is None:
+        return None
+    if jac is not None:
+        logger.warning(
+            "workers is only used by scipy finite difference and is ignored as gradient is supplied. "
+            "Use grad_method='finite_diff' to evaluate finite difference in parallel."
+        )
+        return None
+    if not SCIPY_SLSQP_WORKERS:
+        logger.warning(
+            "Parallel finite difference requires scipy>=1.16. Fall back to serial evaluation."
+        )
+        return None
+    return ThreadPoolExecutor(max_workers=workers, initializer=_mark_fd_worker)
+
+
+def minimize_slsqp(
+    objective_func: Callable,
+    x0: np.ndarray,
+    bounds: optim.Bounds,
+    constraints: List[optim.LinearConstraint],
+    options: Dict,
+    callback: Callable,
+    logger: logging.Logger,
+    jac: Optional[Callable] = None,
+    workers: Optional[int] = None,
+) -> np.ndarray:
+    """run scipy SLSQP shared by all optimizers; finite difference is evaluated by a thread pool when workers
+    is supplied
+    returns: 1-D array like solution with shape (n_vars, )
+    """
+    options = dict(options)
+    executor = derive_fd_executor(workers=workers, jac=jac, logger=logger)
+    if executor is not None:
+        options["workers"] = executor.map
+    try:
+        sol = optim.minimize(
+            objective_func,
+            x0=x0,
+            method="SLSQP",
+            jac=jac,
+            bounds=bounds,
+            constraints=constraints,
+            options=options,
+            callback=callback,
+        )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return sol.x
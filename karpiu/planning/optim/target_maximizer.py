@@ -1,8 +1,54 @@
 import numpy as np
 
 from .budget_optimizer import BudgetOptimizer
+from .optim_utils import in_fd_worker
 from ...utils import adstock_process
 
+# numba is optional; objective falls back to numpy when it is not installed
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+
+def _mmm_response(spend, coefs, adstock_weights, saturation_params):
+    """Derive regression component of MMM response with adstock and saturation
+    spend: 2-D array like with shape (n_calc_steps, n_regressors)
+    coefs: 2-D array like with shape (n_result_steps, n_regressors)
+    adstock_weights: 2-D array like with shape (n_regressors, n_adstock_weights)
+    saturation_params: 1-D array like with shape (n_regressors, )
+    returns: 1-D array like with shape (n_result_steps, )
+    """
+    n_result_steps, n_regressors = coefs.shape
+    n_adstock_weights = adstock_weights.shape[1]
+    comp_matrix = np.empty((n_result_steps, n_regressors))
+    for c in prange(n_regressors):
+        for t in range(n_result_steps):
+            adstocked = 0.0
+            for k in range(n_adstock_weights):
+                adstocked += (
+                    adstock_weights[c, k] * spend[t + n_adstock_weights - 1 - k, c]
+                )
+            comp_matrix[t, c] = coefs[t, c] * np.log1p(adstocked / saturation_params[c])
+
+    spend_comp = np.zeros(n_result_steps)
+    for t in range(n_result_steps):
+        for c in range(n_regressors):
+            spend_comp[t] += comp_matrix[t, c]
+    return spend_comp
+
+
+if njit is not None:
+    # nogil allows concurrent objective evaluations from threads, e.g. parallel finite difference;
+    # no fastmath such that serial and parallel kernels give identical results under finite difference
+    _mmm_response_kernel = njit(cache=True, nogil=True)(_mmm_response)
+    # numba cache index does not distinguish parallel flag of the same function; keep this one uncached
+    _mmm_response_kernel_parallel = njit(parallel=True, nogil=True)(_mmm_response)
+else:
+    _mmm_response_kernel = None
+    _mmm_response_kernel_parallel = None
+
 
 class TargetMaximizer(BudgetOptimizer):
     """Perform target maximization with a given Marketing Mix Model"""
@@ -12,22 +58,125 @@ class TargetMaximizer(BudgetOptimizer):
         self.variance_penalty = variance_penalty
 
     def objective_func(self, spend):
-        spend_matrix = spend.reshape(-1, self.n_optim_channels) * self.spend_scaler
-        zero_paddings = np.zeros((self.max_adstock, self.n_optim_channels))
-        spend_matrix = np.concatenate([zero_paddings, spend_matrix, zero_paddings], 0)
-        spend_matrix += self.target_regressor_bkg_matrix
-        transformed_spend_matrix = adstock_process(
-            spend_matrix, self.target_adstock_matrix
+        spend_matrix = self._derive_calc_spend_matrix(spend)
+        if _mmm_response_kernel is not None:
+            # parallel kernel cannot be launched concurrently (e.g. numba workqueue threading layer aborts);
+            # use the serial one when objective is evaluated from the finite difference thread pool
+            if self.n_optim_channels >= 4 and not in_fd_worker():
+                kernel = _mmm_response_kernel_parallel
+            else:
+                kernel = _mmm_response_kernel
+            spend_comp = kernel(
+                np.ascontiguousarray(spend_matrix, dtype=np.float64),
+                np.ascontiguousarray(self.target_coef_matrix, dtype=np.float64),
+                np.ascontiguousarray(self.target_adstock_matrix, dtype=np.float64),
+                np.ascontiguousarray(self.target_sat_array, dtype=np.float64),
+            )
+        else:
+            spend_comp = self._derive_spend_comp(
+                self._derive_transformed_spend_matrix(spend_matrix)
+            )
+        return self._derive_loss(spend_comp, spend_matrix)
+
+    def batched_objective_func(self, spend_batch):
+        # (n_batches, n_calc_steps, n_optim_channels)
+        spend_matrix = self._derive_calc_spend_matrix(spend_batch)
+        # (n_batches, n_result_steps)
+        spend_comp = self._derive_spend_comp(
+            self._derive_transformed_spend_matrix(spend_matrix)
+        )
+        # (n_batches, )
+        return self._derive_loss(spend_comp, spend_matrix)
+
+    def objective_grad(self, spend):
+        # forward pass identical to objective_func; keep intermediate values for chain rule
+        # (n_calc_steps, n_optim_channels)
+        spend_matrix = self._derive_calc_spend_matrix(spend)
+        # (n_result_steps, n_optim_channels)
+        transformed_spend_matrix = self._derive_transformed_spend_matrix(spend_matrix)
+        # (n_result_steps, )
+        pred_outcome = self._derive_pred_outcome(
+            self._derive_spend_comp(transformed_spend_matrix)
+        )
+
+        # d(loss) / d(transformed_spend_matrix)
+        # (n_result_steps, n_optim_channels)
+        grad_transformed = (
+            -1
+            * np.expand_dims(pred_outcome, -1)
+            / self.response_scaler
+            * self.target_coef_matrix
+            / (self.target_sat_array + transformed_spend_matrix)
+        )
+
+        # adjoint of the adstock convolution
+        # transformed[t, c] = sum_k adstock[c, k] * spend[t + n_weights - 1 - k, c]
+        # (n_calc_steps, n_optim_channels)
+        grad_spend_matrix = np.zeros(spend_matrix.shape)
+        n_result_steps = grad_transformed.shape[0]
+        n_adstock_weights = self.target_adstock_matrix.shape[1]
+        for k in range(n_adstock_weights):
+            start = n_adstock_weights - 1 - k
+            grad_spend_matrix[start : start + n_result_steps] += (
+                self.target_adstock_matrix[:, k] * grad_transformed
+            )
+
+        # d(std) / d(x_i) = (x_i - mean) / (n * std); zero when a channel has no variation
+        spend_std = np.std(spend_matrix, 0)
+        safe_std = np.where(spend_std > 0, spend_std, 1.0)
+        grad_std = (spend_matrix - np.mean(spend_matrix, 0)) / (
+            spend_matrix.shape[0] * safe_std
         )
+        grad_std[:, spend_std <= 0] = 0.0
+        grad_spend_matrix += self.variance_penalty * grad_std
+
+        # only the budget period is the decision variable
+        n_budget_steps = spend.shape[0] // self.n_optim_channels
+        grad_spend_matrix = grad_spend_matrix[
+            self.max_adstock : self.max_adstock + n_budget_steps
+        ]
+        return (grad_spend_matrix * self.spend_scaler).flatten()
+
+    def _derive_calc_spend_matrix(self, spend):
+        # (..., n_budget_steps * n_optim_channels) -> (..., n_calc_steps, n_optim_channels)
+        # budget period spend padded with zeros for adstock and added with spend outside budget period
+        batch_shape = spend.shape[:-1]
+        spend_matrix = (
+            spend.reshape(batch_shape + (-1, self.n_optim_channels)) * self.spend_scaler
+        )
+        zero_paddings = np.zeros(
+            batch_shape + (self.max_adstock, self.n_optim_channels)
+        )
+        spend_matrix = np.concatenate([zero_paddings, spend_matrix, zero_paddings], -2)
+        return spend_matrix + self.target_regressor_bkg_matrix
+
+    def _derive_transformed_spend_matrix(self, spend_matrix):
+        # (..., n_calc_steps, n_optim_channels) -> (..., n_result_steps, n_optim_channels)
+        # adstock_process squeezes the batch dim when the batch size is 1
+        return adstock_process(spend_matrix, self.target_adstock_matrix).reshape(
+            spend_matrix.shape[:-2] + (-1, self.n_optim_channels)
+        )
+
+    def _derive_spend_comp(self, transformed_spend_matrix):
         # regression
-        spend_comp = np.sum(
+        # (..., n_result_steps, n_optim_channels) -> (..., n_result_steps)
+        return np.sum(
             self.target_coef_matrix
             * np.log1p(transformed_spend_matrix / self.target_sat_array),
             -1,
         )
-        # (n_result_steps, )
-        pred_outcome = self.base_comp_result * np.exp(spend_comp)
-        loss = -1 * np.sum(pred_outcome) / self.response_scaler
+
+    def _derive_pred_outcome(self, spend_comp):
+        # (..., n_result_steps)
+        return self.base_comp_result * np.exp(spend_comp)
+
+    def _derive_loss(self, spend_comp, spend_matrix):
+        # (..., n_result_steps), (..., n_calc_steps, n_optim_channels) -> (..., )
+        loss = (
+            -1
+            * np.sum(self._derive_pred_outcome(spend_comp), -1)
+            / self.response_scaler
+        )
         # add punishment of within channel variance of spend; otherwise may risk of identifiability issue with adstock
-        loss += self.variance_penalty * np.sum(np.std(spend_matrix, 0))
+        loss += self.variance_penalty * np.sum(np.std(spend_matrix, -2), -1)
         return loss
@@ -1,12 +1,13 @@
 import pandas as pd
 import numpy as np
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Union
 import logging
 import scipy.optimize as optim
 from copy import deepcopy
 
 from karpiu.models import MMM
 from karpiu.model_shell import MMMShellLegacy
+from .optim_utils import total_budget_matrix, minimize_slsqp
 from ...explainability.attribution_gamma import AttributorGamma
 
 
@@ -64,24 +65,30 @@ class TimeBudgetOptimizer(MMMShellLegacy):
         self.spend_scaler = spend_scaler
         self.constraints = list()
         self.budget_mask = self.input_mask
+        # positional indices of budget period and optimizing channels; derived once and reused for
+        # slicing inputs and writing back solutions
+        self._budget_row_idx = np.flatnonzero(self.budget_mask)
+        # get_loc raises KeyError on unknown channels as label based slicing does
+        self._optim_col_idx = np.array(
+            [self.df.columns.get_loc(ch) for ch in self.optim_channels]
+        )
 
-        n_budget_steps = np.sum(self.input_mask)
-        self.n_budget_steps = n_budget_steps
+        self.n_budget_steps = self._budget_row_idx.size
         self.n_optim_channels = len(self.optim_channels)
 
         # derive optimization input
         # derive init values
         # (n_budget_steps, n_optim_channels)
-        self.init_spend_matrix = self.df.loc[
-            self.budget_mask, self.optim_channels
+        self.init_spend_matrix = self.df.iloc[
+            self._budget_row_idx, self._optim_col_idx
         ].values
 
         # total spend per time step
         # (n_budget_steps, )
         self.init_spend_array = np.sum(self.init_spend_matrix, -1)
         # this stores current optimal spend
-        self.curr_spend_matrix = deepcopy(self.init_spend_matrix)
-        self.curr_spend_array = deepcopy(self.init_spend_array)
+        self.curr_spend_matrix = self.init_spend_matrix.copy()
+        self.curr_spend_array = self.init_spend_array.copy()
 
         if total_budget_override is not None and total_budget_override > 0:
             self.total_budget = total_budget_override
@@ -98,11 +105,14 @@ class TimeBudgetOptimizer(MMMShellLegacy):
         # derive budget bounds for each step and each channel
         self.budget_bounds = optim.Bounds(
             lb=np.zeros(self.n_budget_steps),
-            ub=np.ones(self.n_budget_steps) * np.inf,
+            ub=np.full(self.n_budget_steps, np.inf),
         )
 
-        self.full_channels_spend_matrix = self.df.loc[
-            self.budget_mask, self.full_channels
+        full_col_idx = np.array(
+            [self.df.columns.get_loc(ch) for ch in self.full_channels]
+        )
+        self.full_channels_spend_matrix = self.df.iloc[
+            self._budget_row_idx, full_col_idx
         ].values
 
         # spend allocation on time dimension
@@ -126,6 +136,8 @@ class TimeBudgetOptimizer(MMMShellLegacy):
         self.callback_metrics = dict()
         self._init_callback_metrics()
         self.bounds_and_constraints_df = None
+        # last solution; used as the initial values with optimize(init="last")
+        self._last_x = None
 
     def set_constraints(self, constraints: List[optim.LinearConstraint]):
         self.constraints = constraints
@@ -139,10 +151,10 @@ class TimeBudgetOptimizer(MMMShellLegacy):
         # derive budget constraints based on total sum of init values
         # scipy.optimize.LinearConstraint notation: lb <= A.dot(x) <= ub
         total_budget_constraint = optim.LinearConstraint(
-            A=np.ones(self.n_budget_steps),
+            A=total_budget_matrix(self.n_budget_steps),
             lb=np.zeros(1),
             # lb=np.ones(1) * total_budget / self.spend_scaler,
-            ub=np.ones(1) * total_budget / self.spend_scaler,
+            ub=np.full(1, total_budget / self.spend_scaler),
         )
         return total_budget_constraint
 
@@ -151,19 +163,19 @@ class TimeBudgetOptimizer(MMMShellLegacy):
         return df
 
     def get_current_state(self) -> np.ndarray:
-        return deepcopy(self.curr_spend_array)
+        return self.curr_spend_array.copy()
 
     def get_current_spend_matrix(self) -> np.ndarray:
-        return deepcopy(self.curr_spend_matrix)
+        return self.curr_spend_matrix.copy()
 
     def get_total_budget(self) -> float:
-        return deepcopy(self.total_budget)
+        return float(self.total_budget)
 
     def get_init_state(self) -> np.ndarray:
-        return deepcopy(self.init_spend_array)
+        return self.init_spend_array.copy()
 
     def get_init_spend_matrix(self) -> np.ndarray:
-        return deepcopy(self.init_spend_matrix)
+        return self.init_spend_matrix.copy()
 
     def get_callback_metrics(self) -> Dict[str, np.ndarray]:
         return deepcopy(self.callback_metrics)
@@ -175,44 +187,55 @@ class TimeBudgetOptimizer(MMMShellLegacy):
 
     def optimize(
         self,
-        init: Optional[np.ndarray] = None,
+        init: Optional[Union[np.ndarray, str]] = None,
         maxiter: int = 2,
         eps: float = 1e-3,
         ftol: float = 1e-7,
         disp: bool = True,
+        workers: Optional[int] = None,
     ) -> None:
-        if init is None:
+        if isinstance(init, str) and init == "last":
+            # warm start from the solution of the previous optimize() call
+            if self._last_x is None:
+                raise Exception(
+                    "No previous solution to warm start. Call optimize() without init='last' first."
+                )
+            x0 = self._last_x.copy()
+        elif init is None:
             x0 = self.init_spend_array / self.spend_scaler
         else:
             x0 = init.flatten() / self.spend_scaler
 
-        sol = optim.minimize(
+        options = {
+            "disp": disp,
+            "maxiter": maxiter,
+            "eps": eps,
+            "ftol": ftol,
+        }
+
+        optim_x = minimize_slsqp(
             self.objective_func,
             x0=x0,
-            method="SLSQP",
             bounds=self.budget_bounds,
             constraints=self.constraints,
-            options={
-                "disp": disp,
-                "maxiter": maxiter,
-                "eps": eps,
-                "ftol": ftol,
-            },
+            options=options,
             callback=self.optim_callback,
+            logger=self.logger,
+            workers=workers,
         )
 
-        optim_spend_array = sol.x * self.spend_scaler
-        optim_spend_matrix = (
-            np.expand_dims(optim_spend_array, -1)
-            * np.ones((self.n_budget_steps, self.n_optim_channels))
-            * self.weight
+        self._last_x = optim_x
+
+        optim_spend_array = optim_x * self.spend_scaler
+        # (n_budget_steps, 1) * (n_optim_channels, ) -> (n_budget_steps, n_optim_channels)
+        optim_spend_matrix = np.round(
+            np.expand_dims(optim_spend_array, -1) * self.weight, 5
         )
-        optim_spend_matrix = np.round(optim_spend_matrix, 5)
         # after round-up, recalculate this to make it consistent with sum
         optim_spend_array = np.sum(optim_spend_matrix, -1)
 
         optim_df = self.get_df()
-        optim_df.loc[self.budget_mask, self.optim_channels] = optim_spend_matrix
+        optim_df.iloc[self._budget_row_idx, self._optim_col_idx] = optim_spend_matrix
         self.curr_spend_matrix = optim_spend_matrix
         self.curr_spend_array = optim_spend_array
         return optim_df
@@ -248,9 +271,9 @@ class TimeBudgetOptimizer(MMMShellLegacy):
             self.logger.info("Set total budget constraints.")
 
             total_budget_constraint = optim.LinearConstraint(
-                A=np.ones(self.n_budget_steps),
-                lb=np.ones(1) * total_budget_lower / self.spend_scaler,
-                ub=np.ones(1) * total_budget_upper / self.spend_scaler,
+                A=total_budget_matrix(self.n_budget_steps),
+                lb=np.full(1, total_budget_lower / self.spend_scaler),
+                ub=np.full(1, total_budget_upper / self.spend_scaler),
             )
             self.set_constraints([total_budget_constraint])
 
@@ -2,8 +2,11 @@ import pytest
 import numpy as np
 import pickle
 from copy import deepcopy
+import scipy.optimize as optim
 
 from karpiu.planning.optim import TargetMaximizer
+from karpiu.planning.optim import target_maximizer, optim_utils
+from karpiu.planning.optim.optim_utils import batched_fd_grad, SCIPY_SLSQP_WORKERS
 from karpiu.planning.common import generate_cost_report
 from karpiu.utils import adstock_process
 
@@ -162,3 +165,211 @@ def test_target_maximizer():
     # right now, we turn off adstock make this work
     # something wrong with target max optimization here; the state does not converge
     # assert np.allclose(new_optim_spend_matrix, optim_spend_matrix, atol=1e-1, rtol=1e-1)
+
+
+@pytest.fixture
+def make_target_maximizer():
+    """factory of TargetMaximizer on the seasonal model over 2020-01; extra kwargs are passed into the constructor"""
+    with open("./tests/resources/seasonal-model.pkl", "rb") as f:
+        mmm = pickle.load(f)
+
+    df = mmm.get_raw_df()
+    budget_start = "2020-01-01"
+    budget_end = "2020-01-31"
+    optim_channels = mmm.get_spend_cols()
+    optim_channels.sort()
+
+    def _make_target_maximizer(**kwargs):
+        return TargetMaximizer(
+            model=mmm,
+            budget_start=budget_start,
+            budget_end=budget_end,
+            optim_channels=optim_channels,
+            spend_scaler=1e1,
+            response_scaler=0.01 * np.std(df["sales"].values),
+            **kwargs,
+        )
+
+    return _make_target_maximizer
+
+
+def test_target_maximizer_objective_grad(make_target_maximizer):
+    maximizer = make_target_maximizer()
+    x0 = maximizer.get_init_state().flatten() / maximizer.spend_scaler
+    analytic_grad = maximizer.objective_grad(x0)
+    numeric_grad = optim.approx_fprime(x0, maximizer.objective_func, 1e-6)
+
+    assert analytic_grad.shape == x0.shape
+    assert np.allclose(analytic_grad, numeric_grad, rtol=1e-3, atol=1e-4)
+
+
+@pytest.mark.parametrize("collapse_mode", ["channel", "time"])
+def test_target_maximizer_collapse_mode(make_target_maximizer, collapse_mode):
+    maximizer = make_target_maximizer(collapse_mode=collapse_mode)
+    if collapse_mode == "channel":
+        assert maximizer.n_optim_vars == maximizer.n_optim_channels
+    else:
+        assert maximizer.n_optim_vars == maximizer.n_budget_steps
+
+    _ = maximizer.optimize(maxiter=300, ftol=1e-3)
+    optim_spend_matrix = maximizer.get_current_state()
+    init_spend_matrix = maximizer.get_init_state()
+
+    assert optim_spend_matrix.shape == init_spend_matrix.shape
+    # total budget preserves with the fixed allocation pattern
+    assert np.allclose(np.sum(optim_spend_matrix), np.sum(init_spend_matrix))
+
+
+@pytest.mark.parametrize("collapse_mode", ["channel", "time"])
+def test_target_maximizer_collapse_mode_unnormalized_weight(
+    make_target_maximizer, collapse_mode
+):
+    n_weights = len(make_target_maximizer(collapse_mode=collapse_mode).weight)
+    maximizer = make_target_maximizer(
+        collapse_mode=collapse_mode, weight=np.ones(n_weights)
+    )
+    # full spend matrix is accepted as init under collapse mode
+    _ = maximizer.optimize(init=maximizer.get_init_state(), maxiter=300, ftol=1e-3)
+
+    # total budget is applied on the expanded spend instead of the decision variables
+    assert np.sum(maximizer.get_current_state()) <= maximizer.get_total_budget() * (
+        1 + 1e-3
+    )
+
+
+def test_target_maximizer_batched_objective(make_target_maximizer):
+    maximizer = make_target_maximizer()
+    x0 = maximizer.get_init_state().flatten() / maximizer.spend_scaler
+    spend_batch = np.stack([x0, 0.5 * x0, 2.0 * x0])
+    batched_losses = maximizer.batched_objective_func(spend_batch)
+    losses = np.array([maximizer.objective_func(x) for x in spend_batch])
+    assert np.allclose(batched_losses, losses)
+
+    fd_grad = batched_fd_grad(maximizer.batched_objective_func, x0, eps=1e-6)
+    assert np.allclose(fd_grad, maximizer.objective_grad(x0), rtol=1e-3, atol=1e-4)
+
+
+def test_target_maximizer_individual_channel_constraints(make_target_maximizer):
+    maximizer = make_target_maximizer()
+    delta = 0.1
+    ind_budget_constraints = maximizer.generate_individual_channel_constraints(
+        delta=delta
+    )
+    assert len(ind_budget_constraints) == 1
+    assert ind_budget_constraints[0].A.shape == (
+        maximizer.n_optim_channels,
+        maximizer.n_optim_vars,
+    )
+    maximizer.add_constraints(ind_budget_constraints)
+    _ = maximizer.optimize(maxiter=300, ftol=1e-3)
+
+    init_channel_total = np.sum(maximizer.get_init_state(), 0)
+    optim_channel_total = np.sum(maximizer.get_current_state(), 0)
+    assert np.all(optim_channel_total >= (1 - delta) * init_channel_total - 1e-3)
+    assert np.all(optim_channel_total <= (1 + delta) * init_channel_total + 1e-3)
+
+
+def test_target_maximizer_warm_start(make_target_maximizer):
+    maximizer = make_target_maximizer()
+    with pytest.raises(Exception):
+        maximizer.optimize(init="last")
+
+    _ = maximizer.optimize(maxiter=2)
+    first_x = maximizer.get_current_state().flatten() / maximizer.spend_scaler
+
+    # record the points where the objective is evaluated; scipy evaluates the initial values first
+    evaluated_xs = list()
+    objective_func = maximizer.objective_func
+
+    def recorded_objective_func(spend):
+        evaluated_xs.append(spend.copy())
+        return objective_func(spend)
+
+    maximizer.objective_func = recorded_objective_func
+
+    # warm start is opt-in; the second call continues from the last solution
+    _ = maximizer.optimize(init="last", maxiter=2)
+    assert np.allclose(evaluated_xs[0], first_x, atol=1e-4)
+
+    # without init, optimization starts from the initial spend again
+    evaluated_xs.clear()
+    _ = maximizer.optimize(maxiter=2)
+    init_x = maximizer.get_init_state().flatten() / maximizer.spend_scaler
+    assert np.allclose(evaluated_xs[0], init_x)
+
+
+@pytest.mark.skipif(
+    not SCIPY_SLSQP_WORKERS, reason="parallel finite difference requires scipy>=1.16"
+)
+def test_target_maximizer_parallel_finite_diff(make_target_maximizer, monkeypatch):
+    n_map_calls = list()
+
+    class RecordedThreadPoolExecutor(optim_utils.ThreadPoolExecutor):
+        def map(self, *args, **kwargs):
+            n_map_calls.append(1)
+            return super().map(*args, **kwargs)
+
+    monkeypatch.setattr(optim_utils, "ThreadPoolExecutor", RecordedThreadPoolExecutor)
+
+    optim_spend_matrices = list()
+    for workers in [None, 2]:
+        maximizer = make_target_maximizer()
+        _ = maximizer.optimize(maxiter=2, grad_method="finite_diff", workers=workers)
+        optim_spend_matrices.append(maximizer.get_current_state())
+    # finite difference is evaluated through the thread pool
+    assert len(n_map_calls) > 0
+
+    # threads only change how finite difference is evaluated, not the solution
+    assert np.allclose(optim_spend_matrices[0], optim_spend_matrices[1])
+
+    # workers is not used with the analytic gradient
+    n_map_calls.clear()
+    maximizer = make_target_maximizer()
+    _ = maximizer.optimize(maxiter=2, workers=2)
+    assert len(n_map_calls) == 0
+
+
+@pytest.mark.parametrize(
+    "kernel_name",
+    ["_mmm_response", "_mmm_response_kernel", "_mmm_response_kernel_parallel"],
+)
+def test_mmm_response_kernel(kernel_name):
+    if kernel_name != "_mmm_response":
+        pytest.importorskip("numba")
+    kernel = getattr(target_maximizer, kernel_name)
+
+    rng = np.random.default_rng(2023)
+    n_result_steps, n_regressors, n_adstock_weights = 50, 5, 7
+    spend = rng.random((n_result_steps + n_adstock_weights - 1, n_regressors))
+    coefs = rng.random((n_result_steps, n_regressors))
+    adstock_weights = rng.random((n_regressors, n_adstock_weights))
+    saturation_params = rng.random(n_regressors) + 1.0
+
+    # same as the numpy path of TargetMaximizer.objective_func
+    expected = np.sum(
+        coefs * np.log1p(adstock_process(spend, adstock_weights) / saturation_params),
+        -1,
+    )
+    spend_comp = kernel(spend, coefs, adstock_weights, saturation_params)
+    assert spend_comp.shape == (n_result_steps,)
+    assert np.allclose(spend_comp, expected)
+
+
+def test_mmm_response_kernel_parallel_consistency():
+    pytest.importorskip("numba")
+    rng = np.random.default_rng(2023)
+    n_result_steps, n_regressors, n_adstock_weights = 50, 5, 7
+    spend = rng.random((n_result_steps + n_adstock_weights - 1, n_regressors))
+    coefs = rng.random((n_result_steps, n_regressors))
+    adstock_weights = rng.random((n_regressors, n_adstock_weights))
+    saturation_params = rng.random(n_regressors) + 1.0
+
+    # finite difference mixes both kernels under workers; they must agree exactly
+    assert np.array_equal(
+        target_maximizer._mmm_response_kernel(
+            spend, coefs, adstock_weights, saturation_params
+        ),
+        target_maximizer._mmm_response_kernel_parallel(
+            spend, coefs, adstock_weights, saturation_params
+        ),
+    )